@@ -7,6 +7,7 @@ This script validates the Ansible inventory.yml file:
 2. Verifies required fields and structure
 3. Checks for placeholder values that need to be replaced
 4. Validates IP address formats (optional)
+5. Warns about host IPs outside the declared VLAN networks
 
 Usage:
     python3 check_inventory.py [--inventory <inventory_file>]
@@ -16,14 +17,27 @@ Example:
     python3 check_inventory.py --inventory inventory.yml
 """
 
-import argparse
+import contextlib
+import functools
+import mmap
 import os
+import stat
 import sys
 import yaml
 import re
 from pathlib import Path
 from ipaddress import ip_address, ip_network, AddressValueError
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+try:
+    import pytricia
+except ImportError:
+    pytricia = None
+
 
 # Placeholder patterns to detect
 PLACEHOLDER_PATTERNS = [
@@ -39,9 +53,28 @@ PLACEHOLDER_PATTERNS = [
     r'<WORKER\d+_DATA_IP>',
 ]
 
+# Placeholders without regex syntax are matched as plain substrings
+FIXED_PLACEHOLDERS = {p for p in PLACEHOLDER_PATTERNS if re.escape(p) == p}
+
+# Remaining (numbered) patterns combined into one alternation; group N+1
+# matches _NUMBERED_PATTERNS[N]
+_NUMBERED_PATTERNS = [p for p in PLACEHOLDER_PATTERNS if p not in FIXED_PLACEHOLDERS]
+_NUMBERED_RE = re.compile('|'.join(f'({p})' for p in _NUMBERED_PATTERNS))
+
+# Strict dotted-quad IPv4 (no leading zeros, like ipaddress)
+_IPV4_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_IPV4_RE = re.compile(rf'(?:{_IPV4_OCTET}\.){{3}}{_IPV4_OCTET}')
+
 # Required groups
 REQUIRED_GROUPS = ['bastion', 'masters', 'workers']
 
+# Host type for each required group
+GROUP_TO_TYPE = {
+    'bastion': 'bastion',
+    'masters': 'master',
+    'workers': 'worker',
+}
+
 # Required fields for each host type
 REQUIRED_HOST_FIELDS = {
     'bastion': ['ansible_host', 'ansible_hostname', 'ansible_user', 
@@ -52,6 +85,14 @@ REQUIRED_HOST_FIELDS = {
                'ansible_ssh_private_key_file', 'mgmt_ip', 'prod_data_ip'],
 }
 
+# Set form of REQUIRED_HOST_FIELDS for missing-field checks
+_REQUIRED_HOST_FIELD_SETS = {
+    host_type: frozenset(fields) for host_type, fields in REQUIRED_HOST_FIELDS.items()
+}
+
+# Host fields holding IP addresses
+HOST_IP_FIELDS = ['ansible_host', 'internal_ip', 'mgmt_ip', 'prod_data_ip']
+
 # Required vars in all.vars
 REQUIRED_VARS = [
     'ansible_python_interpreter',
@@ -62,6 +103,39 @@ REQUIRED_VARS = [
     'lb_vip_control',
     'lb_vip_data',
 ]
+_REQUIRED_VAR_SET = frozenset(REQUIRED_VARS)
+
+
+def _read_inventory_buffer(f):
+    """Open the file contents as a buffer for the YAML loader.
+
+    Regular, non-empty files are memory-mapped read-only. Pipes and other
+    special files report size 0 and cannot be mapped, so they (and any file
+    mmap rejects) are read into bytes instead. Use as a context manager.
+
+    Kept identical in check_inventory.py and check_ssh_config.py, which are
+    standalone scripts.
+    """
+    st = os.fstat(f.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            pass
+    return contextlib.nullcontext(f.read())
+
+
+def _label_yaml_error(error, inventory_path):
+    """Set the file name on a YAML error's marks.
+
+    Buffers carry no file name, so marks would otherwise read "<file>".
+    Kept identical in check_inventory.py and check_ssh_config.py.
+    """
+    for attr in ('context_mark', 'problem_mark'):
+        mark = getattr(error, attr, None)
+        if mark is not None:
+            # libyaml marks are read-only, so replace them
+            setattr(error, attr, yaml.Mark(inventory_path, mark.index, mark.line, mark.column, None, None))
 
 
 def load_inventory(inventory_path):
@@ -71,10 +145,11 @@ def load_inventory(inventory_path):
         sys.exit(1)
     
     try:
-        with open(inventory_path, 'r') as f:
-            inventory = yaml.safe_load(f)
+        with open(inventory_path, 'rb') as f, _read_inventory_buffer(f) as buffer:
+            inventory = yaml.load(buffer, Loader=SafeLoader)
         return inventory
     except yaml.YAMLError as e:
+        _label_yaml_error(e, inventory_path)
         print(f"ERROR: Invalid YAML syntax in {inventory_path}: {e}", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
@@ -82,46 +157,77 @@ def load_inventory(inventory_path):
         sys.exit(1)
 
 
-def check_placeholder(value, path=""):
-    """Check if a value contains placeholder patterns."""
-    if not isinstance(value, str):
-        return []
-    
-    found_placeholders = []
-    for pattern in PLACEHOLDER_PATTERNS:
-        if re.search(pattern, value):
-            found_placeholders.append(pattern)
+def has_placeholder(value):
+    """Check if a string value contains any placeholder."""
+    return (any(p in value for p in FIXED_PLACEHOLDERS)
+            or _NUMBERED_RE.search(value) is not None)
+
+
+def describe_placeholders(value):
+    """Return the placeholder patterns found in a string value."""
+    matched = {p for p in FIXED_PLACEHOLDERS if p in value}
+    for match in _NUMBERED_RE.finditer(value):
+        matched.add(_NUMBERED_PATTERNS[match.lastindex - 1])
     
-    return found_placeholders
+    return [p for p in PLACEHOLDER_PATTERNS if p in matched]
+
+
+def _format_path(parts):
+    """Render a tuple of (is_index, key) path segments as 'a.b[0].c'."""
+    path = ""
+    for is_index, key in parts:
+        if is_index:
+            path += f"[{key}]"
+        elif path:
+            path += f".{key}"
+        else:
+            path = f"{key}"
+    return path
 
 
-def find_placeholders(data, path="", found=None):
-    """Recursively find all placeholder values in inventory."""
-    if found is None:
-        found = []
+def find_placeholders(data):
+    """Find all placeholder values in inventory.
+
+    Walks the tree iteratively in document order. Path strings are only
+    built for values that actually contain a placeholder.
+    """
+    found = []
+    if not isinstance(data, (dict, list)):
+        return found
     
-    if isinstance(data, dict):
-        for key, value in data.items():
-            current_path = f"{path}.{key}" if path else key
-            placeholders = check_placeholder(value, current_path)
-            if placeholders:
+    stack = [(data, ())]
+    while stack:
+        node, parts = stack.pop()
+        
+        if type(node) is str:
+            # Every placeholder starts with '<'; skip the regex otherwise
+            if '<' in node and has_placeholder(node):
                 found.append({
-                    'path': current_path,
-                    'value': value,
-                    'placeholders': placeholders
+                    'path': _format_path(parts),
+                    'value': node,
+                    'placeholders': describe_placeholders(node)
                 })
-            else:
-                find_placeholders(value, current_path, found)
-    elif isinstance(data, list):
-        for i, item in enumerate(data):
-            current_path = f"{path}[{i}]" if path else f"[{i}]"
-            find_placeholders(item, current_path, found)
+        elif isinstance(node, dict):
+            # Push in reverse so children are visited in document order
+            for key, value in reversed(list(node.items())):
+                stack.append((value, parts + ((False, key),)))
+        elif isinstance(node, list):
+            # Only dict values are checked for placeholders; list items
+            # are descended into but never matched directly
+            for i in range(len(node) - 1, -1, -1):
+                item = node[i]
+                if isinstance(item, (dict, list)):
+                    stack.append((item, parts + ((True, i),)))
     
     return found
 
 
+@functools.lru_cache(maxsize=1024)
 def validate_ip_address(ip_str):
     """Validate IP address format."""
+    # Plain IPv4 is the common case; only fall back to ipaddress otherwise
+    if _IPV4_RE.fullmatch(ip_str):
+        return True
     try:
         ip_address(ip_str)
         return True
@@ -129,6 +235,7 @@ def validate_ip_address(ip_str):
         return False
 
 
+@functools.lru_cache(maxsize=1024)
 def validate_ip_network(network_str):
     """Validate IP network format (CIDR notation)."""
     try:
@@ -138,6 +245,60 @@ def validate_ip_network(network_str):
         return False
 
 
+def build_network_lookup(networks):
+    """Build a longest-prefix lookup over CIDR networks.
+
+    Returns a function mapping an IP string to the containing network, or
+    None if no network contains it. Addresses only match networks of the
+    same IP version. Uses PyTricia radix tries (one per IP version) when
+    available and falls back to a linear scan with ipaddress otherwise.
+    """
+    parsed = [ip_network(network, strict=False) for network in networks]
+    
+    if pytricia is not None:
+        tries = {4: pytricia.PyTricia(32), 6: pytricia.PyTricia(128)}
+        for network in parsed:
+            tries[network.version][str(network)] = str(network)
+        
+        def lookup(ip_str):
+            ip = ip_address(ip_str)
+            return tries[ip.version].get_key(ip)
+        
+        return lookup
+    
+    def lookup(ip_str):
+        ip = ip_address(ip_str)
+        for network in parsed:
+            if ip in network:
+                return str(network)
+        return None
+    
+    return lookup
+
+
+def walk_inventory(inventory, groups=None):
+    """Yield (group, host_name, host_vars) for each host in the inventory.
+
+    Visits only the given groups when provided; groups without hosts are
+    skipped.
+    """
+    children = inventory.get('all', {}).get('children') or {}
+    for group in children if groups is None else groups:
+        group_section = children.get(group)
+        if not group_section or not group_section.get('hosts'):
+            continue
+        for host_name, host_vars in group_section['hosts'].items():
+            yield group, host_name, host_vars or {}
+
+
+def string_fields(section, fields):
+    """Yield (field, value) for each of the given fields holding a string."""
+    for field in fields:
+        value = section.get(field)
+        if type(value) is str:
+            yield field, value
+
+
 def validate_inventory_structure(inventory):
     """Validate inventory structure and required fields."""
     errors = []
@@ -154,9 +315,10 @@ def validate_inventory_structure(inventory):
     if 'vars' not in all_section:
         errors.append("Missing 'vars' section in 'all'")
     else:
-        vars_section = all_section['vars']
+        missing_vars = _REQUIRED_VAR_SET.difference(all_section['vars'] or {})
+        # Report in REQUIRED_VARS order
         for var in REQUIRED_VARS:
-            if var not in vars_section:
+            if var in missing_vars:
                 errors.append(f"Missing required variable: {var}")
     
     # Check required groups
@@ -178,26 +340,18 @@ def validate_inventory_structure(inventory):
             errors.append(f"Missing 'hosts' section in group '{group}'")
             continue
         
-        hosts = group_section['hosts']
-        
-        if not hosts:
+        if not group_section['hosts']:
             warnings.append(f"Group '{group}' has no hosts defined")
             continue
         
         # Validate each host
-        for host_name, host_vars in hosts.items():
-            if group == 'bastion':
-                host_type = 'bastion'
-            elif group == 'masters':
-                host_type = 'master'
-            elif group == 'workers':
-                host_type = 'worker'
-            else:
+        host_type = GROUP_TO_TYPE[group]
+        for _, host_name, host_vars in walk_inventory(inventory, [group]):
+            missing_fields = _REQUIRED_HOST_FIELD_SETS[host_type].difference(host_vars)
+            if not missing_fields:
                 continue
-            
-            required_fields = REQUIRED_HOST_FIELDS.get(host_type, [])
-            for field in required_fields:
-                if field not in host_vars:
+            for field in REQUIRED_HOST_FIELDS[host_type]:
+                if field in missing_fields:
                     errors.append(f"Host '{host_name}' ({group}) missing required field: {field}")
     
     return errors, warnings
@@ -209,54 +363,46 @@ def validate_ip_addresses(inventory):
     warnings = []
     
     all_section = inventory.get('all', {})
-    children = all_section.get('children', {})
     
     # Validate network vars
     network_vars = ['control_vlan_network', 'data_vlan_network']
     vars_section = all_section.get('vars', {})
-    for var in network_vars:
-        if var in vars_section:
-            value = vars_section[var]
-            if isinstance(value, str) and not validate_ip_network(value):
-                errors.append(f"Invalid network format in {var}: {value}")
+    networks = []
+    for var, value in string_fields(vars_section, network_vars):
+        if validate_ip_network(value):
+            networks.append(value)
+        else:
+            errors.append(f"Invalid network format in {var}: {value}")
+    
+    # Host IPs are expected to lie within one of the declared networks; only
+    # check this when every network var is present and valid, otherwise a
+    # single typo would flag every IP in that VLAN as well
+    find_network = None
+    if len(networks) == len(network_vars):
+        find_network = build_network_lookup(networks)
     
     # Validate gateway and VIP vars
     ip_vars = ['control_vlan_gateway', 'data_vlan_gateway', 'lb_vip_control', 'lb_vip_data']
-    for var in ip_vars:
-        if var in vars_section:
-            value = vars_section[var]
-            if isinstance(value, str) and not validate_ip_address(value):
-                errors.append(f"Invalid IP address format in {var}: {value}")
+    for var, value in string_fields(vars_section, ip_vars):
+        if not validate_ip_address(value):
+            errors.append(f"Invalid IP address format in {var}: {value}")
     
     # Validate host IPs
-    for group_name, group_section in children.items():
-        if 'hosts' not in group_section:
-            continue
-        
-        for host_name, host_vars in group_section['hosts'].items():
-            # Check ansible_host
-            if 'ansible_host' in host_vars:
-                ip = host_vars['ansible_host']
-                if isinstance(ip, str) and not validate_ip_address(ip):
-                    errors.append(f"Invalid IP address in {host_name}.ansible_host: {ip}")
-            
-            # Check internal_ip (bastion)
-            if 'internal_ip' in host_vars:
-                ip = host_vars['internal_ip']
-                if isinstance(ip, str) and not validate_ip_address(ip):
-                    errors.append(f"Invalid IP address in {host_name}.internal_ip: {ip}")
-            
-            # Check mgmt_ip and prod_data_ip (workers)
-            for ip_field in ['mgmt_ip', 'prod_data_ip']:
-                if ip_field in host_vars:
-                    ip = host_vars[ip_field]
-                    if isinstance(ip, str) and not validate_ip_address(ip):
-                        errors.append(f"Invalid IP address in {host_name}.{ip_field}: {ip}")
+    for group, host_name, host_vars in walk_inventory(inventory):
+        for ip_field, ip in string_fields(host_vars, HOST_IP_FIELDS):
+            if not validate_ip_address(ip):
+                errors.append(f"Invalid IP address in {host_name}.{ip_field}: {ip}")
+            elif find_network is not None and find_network(ip) is None:
+                warnings.append(f"{host_name}.{ip_field} ({ip}) is not within any declared VLAN network")
     
     return errors, warnings
 
 
-def main():
+def build_arg_parser():
+    """Build the argparse parser used for --help and malformed arguments."""
+    # Imported lazily: plain invocations never need argparse
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description='Validate Ansible inventory.yml file',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -267,15 +413,41 @@ def main():
         default='inventory.yml',
         help='Path to inventory file (default: inventory.yml)'
     )
+    return parser
+
+
+def parse_inventory_arg(argv):
+    """Return the inventory path from command-line arguments.
+
+    Handles '--inventory <path>' and '--inventory=<path>' directly; anything
+    else (including -h/--help) is handed to argparse.
+    """
+    inventory_path = 'inventory.yml'
+    args = iter(argv)
+    for arg in args:
+        if arg == '--inventory':
+            inventory_path = next(args, None)
+            if inventory_path is None:
+                break
+        elif arg.startswith('--inventory='):
+            inventory_path = arg[len('--inventory='):]
+        else:
+            break
+    else:
+        return inventory_path
     
-    args = parser.parse_args()
+    return build_arg_parser().parse_args(argv).inventory
+
+
+def main():
+    inventory_path = parse_inventory_arg(sys.argv[1:])
     
-    print(f"Validating inventory file: {args.inventory}")
+    print(f"Validating inventory file: {inventory_path}")
     print("-" * 60)
     
     # Load inventory
     try:
-        inventory = load_inventory(args.inventory)
+        inventory = load_inventory(inventory_path)
         print("✓ YAML syntax is valid")
     except SystemExit:
         sys.exit(1)
@@ -307,6 +479,7 @@ def main():
         print("✓ No placeholder values found")
     
     # Validate IP addresses (only if no placeholders found)
+    ip_errors = []
     if not placeholders:
         ip_errors, ip_warnings = validate_ip_addresses(inventory)
         
@@ -324,10 +497,7 @@ def main():
     
     # Summary
     print("\n" + "-" * 60)
-    total_errors = len(structure_errors)
-    if not placeholders:
-        ip_errors, _ = validate_ip_addresses(inventory)
-        total_errors += len(ip_errors)
+    total_errors = len(structure_errors) + len(ip_errors)
     
     if total_errors == 0 and not placeholders:
         print("✓ Inventory file is valid and ready to use!")
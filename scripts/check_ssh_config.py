@@ -5,29 +5,92 @@ SSH Configuration Verification Script
 This script verifies that SSH configuration is properly set up for Ansible access:
 1. Checks that the public key from bastion host is in authorized_keys on all target nodes
 2. Checks that all target node host keys are in known_hosts on bastion host
+   (with --verify-host-keys, also that they match the keys the nodes present)
 
 Usage:
-    python3 check_ssh_config.py --user <ssh_user> --key <path_to_private_key> [--inventory <inventory_file>]
+    python3 check_ssh_config.py --user <ssh_user> --key <path_to_private_key> [--inventory <inventory_file>] [--verify-host-keys]
 
 Example:
     python3 check_ssh_config.py --user ubuntu --key ~/.ssh/gcp_rke2_key
 """
 
 import argparse
+import base64
+import binascii
+import contextlib
+import hashlib
+import hmac
+import mmap
 import os
+import re
+import shutil
+import stat
 import sys
 import subprocess
+import tempfile
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+# Upper bound on concurrent ssh subprocesses
+MAX_PARALLEL_CHECKS = 32
+
+# Keep SSH master connections alive between checks within a single run
+SSH_CONTROL_PERSIST = '60s'
+
+# Per-host connect timeout for ssh-keyscan, in seconds
+KEYSCAN_TIMEOUT = 2
+
+# Marks the start of each check's output in a batched remote script
+REMOTE_CHECK_DELIMITER = '=== CHECK: '
+
+
+def _read_inventory_buffer(f):
+    """Open the file contents as a buffer for the YAML loader.
+
+    Regular, non-empty files are memory-mapped read-only. Pipes and other
+    special files report size 0 and cannot be mapped, so they (and any file
+    mmap rejects) are read into bytes instead. Use as a context manager.
+
+    Kept identical in check_inventory.py and check_ssh_config.py, which are
+    standalone scripts.
+    """
+    st = os.fstat(f.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            pass
+    return contextlib.nullcontext(f.read())
+
+
+def _label_yaml_error(error, inventory_path):
+    """Set the file name on a YAML error's marks.
+
+    Buffers carry no file name, so marks would otherwise read "<file>".
+    Kept identical in check_inventory.py and check_ssh_config.py.
+    """
+    for attr in ('context_mark', 'problem_mark'):
+        mark = getattr(error, attr, None)
+        if mark is not None:
+            # libyaml marks are read-only, so replace them
+            setattr(error, attr, yaml.Mark(inventory_path, mark.index, mark.line, mark.column, None, None))
+
 
 def load_inventory(inventory_path):
     """Load and parse Ansible inventory YAML file."""
     try:
-        with open(inventory_path, 'r') as f:
-            inventory = yaml.safe_load(f)
+        with open(inventory_path, 'rb') as f, _read_inventory_buffer(f) as buffer:
+            inventory = yaml.load(buffer, Loader=SafeLoader)
         return inventory
     except Exception as e:
+        _label_yaml_error(e, inventory_path)
         print(f"ERROR: Failed to load inventory file {inventory_path}: {e}", file=sys.stderr)
         sys.exit(1)
 
@@ -72,37 +135,79 @@ def get_bastion_host(inventory):
 
 
 def get_public_key_from_private(private_key_path):
-    """Extract public key from private key file."""
-    public_key_path = private_key_path + '.pub'
-    
-    if not os.path.exists(public_key_path):
-        print(f"ERROR: Public key file not found: {public_key_path}", file=sys.stderr)
-        print("      Generate it with: ssh-keygen -y -f <private_key> > <private_key>.pub", file=sys.stderr)
-        return None
+    """Extract public key from the .pub file next to a private key Path."""
+    public_key_path = private_key_path.with_name(private_key_path.name + '.pub')
     
     try:
         with open(public_key_path, 'r') as f:
             public_key = f.read().strip()
         return public_key
+    except FileNotFoundError:
+        print(f"ERROR: Public key file not found: {public_key_path}", file=sys.stderr)
+        print("      Generate it with: ssh-keygen -y -f <private_key> > <private_key>.pub", file=sys.stderr)
+        return None
     except Exception as e:
         print(f"ERROR: Failed to read public key file {public_key_path}: {e}", file=sys.stderr)
         return None
 
 
-def check_public_key_in_authorized_keys(host_ip, user, public_key, private_key_path):
-    """Check if public key exists in authorized_keys on remote host."""
+@contextlib.contextmanager
+def ssh_control_dir():
+    """Provide a private ControlPath directory for one verification run.
+
+    Masters started in it are closed with 'ssh -O exit' and the directory
+    removed on exit, so later runs always authenticate afresh and no
+    background ssh processes are left behind.
+    """
+    control_dir = tempfile.mkdtemp(prefix='ssh-cm-')
+    try:
+        yield control_dir
+    finally:
+        for name in os.listdir(control_dir):
+            try:
+                subprocess.run(
+                    ['ssh', '-S', os.path.join(control_dir, name), '-O', 'exit', 'control-master'],
+                    capture_output=True,
+                    timeout=5
+                )
+            except (subprocess.TimeoutExpired, OSError):
+                pass
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+def run_remote_checks(host_ip, user, private_key_path, checks, control_dir=None):
+    """Run several shell commands on a remote host over a single SSH login.
+
+    checks maps a check name to a shell command. The commands run in one
+    remote shell, each preceded by a delimiter line, and their output is
+    split back out per check. If control_dir (from ssh_control_dir) is
+    given, the connection goes through an SSH ControlMaster there so further
+    calls to the same host in this run reuse the established session.
+
+    Returns (outputs, error): outputs maps each check name to its stdout
+    lines, or is None with an error message if SSH itself failed.
+    """
+    script = '; '.join(
+        f'echo "{REMOTE_CHECK_DELIMITER}{name}"; {command}'
+        for name, command in checks.items()
+    )
+    
     try:
-        # Use ssh to check authorized_keys remotely
         # Note: This requires SSH access to work, which means the key should already be set up
         cmd = [
             'ssh',
             '-o', 'StrictHostKeyChecking=no',
             '-o', 'ConnectTimeout=5',
             '-o', 'BatchMode=yes',  # Non-interactive, fail if key auth doesn't work
-            '-i', os.path.expanduser(private_key_path),
-            f'{user}@{host_ip}',
-            f'grep -Fx "{public_key}" ~/.ssh/authorized_keys > /dev/null 2>&1 && echo "FOUND" || echo "NOT_FOUND"'
+            '-i', str(private_key_path),
         ]
+        if control_dir is not None:
+            cmd += [
+                '-o', 'ControlMaster=auto',
+                '-o', f'ControlPath={control_dir}/%C',
+                '-o', f'ControlPersist={SSH_CONTROL_PERSIST}',
+            ]
+        cmd += [f'{user}@{host_ip}', script]
         
         result = subprocess.run(
             cmd,
@@ -110,43 +215,211 @@ def check_public_key_in_authorized_keys(host_ip, user, public_key, private_key_p
             text=True,
             timeout=10
         )
-        
-        if result.returncode == 0 and 'FOUND' in result.stdout:
-            return True, None
-        elif result.returncode == 0 and 'NOT_FOUND' in result.stdout:
-            return False, "Public key not found in authorized_keys"
-        else:
-            # SSH connection failed - key might not be set up
-            return False, f"SSH connection failed (return code: {result.returncode})"
     except subprocess.TimeoutExpired:
-        return False, "SSH connection timeout"
+        return None, "SSH connection timeout"
+    except Exception as e:
+        return None, f"Error: {str(e)}"
+    
+    if result.returncode != 0:
+        # SSH connection failed - key might not be set up
+        return None, f"SSH connection failed (return code: {result.returncode})"
+    
+    outputs = {name: [] for name in checks}
+    current = None
+    for line in result.stdout.splitlines():
+        if line.startswith(REMOTE_CHECK_DELIMITER):
+            current = line[len(REMOTE_CHECK_DELIMITER):]
+        elif current in outputs:
+            outputs[current].append(line)
+    
+    return outputs, None
+
+
+def check_public_key_in_authorized_keys(host_ip, user, public_key, private_key_path, control_dir=None):
+    """Check if public key exists in authorized_keys on remote host."""
+    # Fetch the file and compare locally, so the key is never interpolated
+    # into a remote shell command
+    outputs, error = run_remote_checks(host_ip, user, private_key_path, {
+        'authorized_keys': 'cat ~/.ssh/authorized_keys 2>/dev/null || true',
+    }, control_dir)
+    if error:
+        return False, error
+    
+    authorized_keys = {line.strip() for line in outputs['authorized_keys']}
+    if public_key.strip() in authorized_keys:
+        return True, None
+    return False, "Public key not found in authorized_keys"
+
+
+def _compile_host_pattern(pattern):
+    """Compile an OpenSSH host pattern ('*' and '?' wildcards) to a regex."""
+    regex = ''.join(
+        '.*' if c == '*' else '.' if c == '?' else re.escape(c)
+        for c in pattern
+    )
+    return re.compile(regex, re.IGNORECASE)
+
+
+def _add_known_hosts_entry(entries, hosts_field, key):
+    """Add one known_hosts line's host field and key to a host entry store.
+
+    entries is a (plain_hosts, pattern_hosts, hashed_hosts) tuple as
+    described in _load_known_hosts.
+    """
+    plain_hosts, pattern_hosts, hashed_hosts = entries
+    hosts = hosts_field.split(',')
+    
+    # A negated pattern applies to the whole line, so keep such lines
+    # (and wildcard lines) together for match_hostname-style matching
+    if any(h.startswith('!') or '*' in h or '?' in h for h in hosts):
+        pattern_hosts.append((
+            [_compile_host_pattern(h) for h in hosts if not h.startswith('!')],
+            [_compile_host_pattern(h[1:]) for h in hosts if h.startswith('!')],
+            key
+        ))
+        return
+    
+    for host in hosts:
+        if host.startswith('|1|'):
+            try:
+                _, _, salt, digest = host.split('|')
+                hashed_hosts.append((base64.b64decode(salt), base64.b64decode(digest), key))
+            except (ValueError, binascii.Error):
+                continue
+        else:
+            plain_hosts.setdefault(host.lower(), set()).add(key)
+
+
+def _match_known_hosts_entries(host_ip, entries):
+    """Return the keys in a host entry store that apply to host_ip.
+
+    Follows OpenSSH host matching: literal names, '*'/'?' wildcards with
+    '!' negation, and hashed entries.
+    """
+    plain_hosts, pattern_hosts, hashed_hosts = entries
+    keys = set(plain_hosts.get(host_ip.lower(), ()))
+    
+    for patterns, negated_patterns, key in pattern_hosts:
+        if any(p.fullmatch(host_ip) for p in negated_patterns):
+            continue
+        if any(p.fullmatch(host_ip) for p in patterns):
+            keys.add(key)
+    
+    host = host_ip.encode()
+    for salt, digest, key in hashed_hosts:
+        if hmac.new(salt, host, hashlib.sha1).digest() == digest:
+            keys.add(key)
+    return keys
+
+
+def _load_known_hosts(known_hosts_path):
+    """Parse a known_hosts file into host key and cert-authority entries.
+
+    Returns a (host_keys, ca_keys) tuple. Each is a (plain_hosts,
+    pattern_hosts, hashed_hosts) store: plain_hosts maps each literal host
+    name to its set of (key_type, key) pairs, pattern_hosts is a list of
+    (patterns, negated_patterns, key) entries for lines using wildcards or
+    '!' negation, and hashed_hosts is a list of decoded (salt, digest, key)
+    entries from OpenSSH '|1|salt|hash' host names. ca_keys holds
+    @cert-authority lines; @revoked lines are ignored.
+    """
+    host_keys = ({}, [], [])
+    ca_keys = ({}, [], [])
+    known_hosts = (host_keys, ca_keys)
+    
+    try:
+        with open(known_hosts_path, 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return known_hosts
     except Exception as e:
-        return False, f"Error: {str(e)}"
+        print(f"  WARNING: Could not read known_hosts file {known_hosts_path}: {e}", file=sys.stderr)
+        return known_hosts
+    
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        
+        entries = host_keys
+        if fields[0] == '@cert-authority':
+            entries = ca_keys
+            fields = fields[1:]
+        elif fields[0].startswith('@'):
+            # @revoked (or unknown markers) never make a host trusted
+            continue
+        
+        if len(fields) < 3:
+            continue
+        _add_known_hosts_entry(entries, fields[0], (fields[1], fields[2]))
+    
+    return known_hosts
+
+
+def get_known_host_keys(host_ip, known_hosts):
+    """Return all (key_type, key) host keys recorded for a host in known_hosts.
 
+    Cert-authority keys are not included. A missing or non-string host
+    (e.g. an empty ansible_host) has no keys.
+    """
+    if not isinstance(host_ip, str):
+        return set()
+    return _match_known_hosts_entries(host_ip, known_hosts[0])
 
-def get_host_key_from_known_hosts(host_ip, known_hosts_path):
-    """Check if host key exists in known_hosts file using ssh-keygen -F."""
-    if not os.path.exists(known_hosts_path):
+
+def is_host_covered_by_cert_authority(host_ip, known_hosts):
+    """Check if a @cert-authority line in known_hosts applies to a host."""
+    if not isinstance(host_ip, str):
         return False
+    return bool(_match_known_hosts_entries(host_ip, known_hosts[1]))
+
+
+def get_host_key_from_known_hosts(host_ip, known_hosts):
+    """Check if known_hosts trusts a host, by host key or cert-authority."""
+    return (bool(get_known_host_keys(host_ip, known_hosts))
+            or is_host_covered_by_cert_authority(host_ip, known_hosts))
+
+
+def _batch_keyscan(host_ips):
+    """Fetch current host keys for all hosts with a single ssh-keyscan call.
+
+    Returns a dict mapping each responding host to its set of
+    (key_type, key) pairs. Hosts that did not answer, or are not a string
+    (e.g. an empty ansible_host), are absent.
+    """
+    scanned = {}
+    host_ips = [ip for ip in host_ips if isinstance(ip, str)]
+    if not host_ips:
+        return scanned
     
     try:
-        # Use ssh-keygen -F to check if host is in known_hosts
-        # This works with both hashed and unhashed entries
-        cmd = ['ssh-keygen', '-F', host_ip, '-f', known_hosts_path]
         result = subprocess.run(
-            cmd,
+            ['ssh-keyscan', '-T', str(KEYSCAN_TIMEOUT)] + host_ips,
             capture_output=True,
             text=True,
-            timeout=5
+            timeout=KEYSCAN_TIMEOUT * len(host_ips) + 10
         )
-        
-        # ssh-keygen -F returns 0 if host is found, 1 if not found
-        return result.returncode == 0
     except subprocess.TimeoutExpired:
-        return False
+        print("  WARNING: ssh-keyscan timed out", file=sys.stderr)
+        return scanned
     except Exception as e:
-        print(f"  WARNING: Could not check known_hosts for {host_ip}: {e}", file=sys.stderr)
-        return False
+        print(f"  WARNING: Could not run ssh-keyscan: {e}", file=sys.stderr)
+        return scanned
+    
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) < 3 or fields[0].startswith('#'):
+            continue
+        scanned.setdefault(fields[0], set()).add((fields[1], fields[2]))
+    
+    return scanned
+
+
+def run_parallel(func, target_hosts):
+    """Run func(host) for every target host concurrently, results in host order."""
+    max_workers = min(MAX_PARALLEL_CHECKS, len(target_hosts))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, target_hosts))
 
 
 def main():
@@ -170,15 +443,22 @@ def main():
         default='inventory.yml',
         help='Path to Ansible inventory file (default: inventory.yml)'
     )
+    parser.add_argument(
+        '--verify-host-keys',
+        action='store_true',
+        help='Also compare known_hosts entries against the keys the hosts currently present (uses ssh-keyscan)'
+    )
     
     args = parser.parse_args()
     
     # Expand user home directory
-    private_key_path = os.path.expanduser(args.key)
-    known_hosts_path = os.path.expanduser(f'~{args.user}/.ssh/known_hosts')
+    # os.path.expanduser leaves the path unchanged if the user has no local
+    # account, where Path.expanduser would raise
+    private_key_path = Path(os.path.expanduser(args.key))
+    known_hosts_path = Path(os.path.expanduser(f'~{args.user}/.ssh/known_hosts'))
     
     # Validate private key exists
-    if not os.path.exists(private_key_path):
+    if not private_key_path.exists():
         print(f"ERROR: Private key file not found: {private_key_path}", file=sys.stderr)
         sys.exit(1)
     
@@ -212,9 +492,17 @@ def main():
     authorized_keys_ok = True
     failed_hosts = []
     
-    for host in target_hosts:
+    # SSH checks are network-bound, so run them concurrently and report in order
+    with ssh_control_dir() as control_dir:
+        results = run_parallel(
+            lambda host: check_public_key_in_authorized_keys(
+                host['ip'], args.user, public_key, private_key_path, control_dir
+            ),
+            target_hosts
+        )
+    
+    for host, (found, error_msg) in zip(target_hosts, results):
         print(f"Checking {host['name']} ({host['ip']})...", end=' ')
-        found, error_msg = check_public_key_in_authorized_keys(host['ip'], args.user, public_key, private_key_path)
         if found:
             print("✓ Public key found in authorized_keys")
         else:
@@ -229,17 +517,34 @@ def main():
     
     known_hosts_ok = True
     missing_host_keys = []
+    mismatched_host_keys = []
     
     print(f"Checking known_hosts file: {known_hosts_path}")
+    known_hosts = _load_known_hosts(known_hosts_path)
+    
+    scanned_keys = None
+    if args.verify_host_keys:
+        print("Fetching current host keys with ssh-keyscan...")
+        scanned_keys = _batch_keyscan([host['ip'] for host in target_hosts])
     
     for host in target_hosts:
         print(f"Checking {host['name']} ({host['ip']})...", end=' ')
-        if get_host_key_from_known_hosts(host['ip'], known_hosts_path):
-            print("✓ Host key found in known_hosts")
-        else:
+        if not get_host_key_from_known_hosts(host['ip'], known_hosts):
             print("✗ Host key NOT found in known_hosts")
             known_hosts_ok = False
             missing_host_keys.append(host)
+        elif scanned_keys is None:
+            print("✓ Host key found in known_hosts")
+        elif host['ip'] not in scanned_keys:
+            print("✓ Host key found in known_hosts (⚠ host did not answer ssh-keyscan, not verified)")
+        elif not get_known_host_keys(host['ip'], known_hosts):
+            print("✓ Host covered by @cert-authority in known_hosts (host key not compared)")
+        elif scanned_keys[host['ip']] & get_known_host_keys(host['ip'], known_hosts):
+            print("✓ Host key found in known_hosts and matches the host")
+        else:
+            print("✗ Host key in known_hosts does NOT match the host")
+            known_hosts_ok = False
+            mismatched_host_keys.append(host)
     
     # Final result
     print("\n" + "="*70)
@@ -268,16 +573,24 @@ def main():
             print(f"    Public key content:")
             print(f"      {public_key}")
         
-        if not known_hosts_ok:
+        if missing_host_keys:
             print(f"\n  ✗ Host keys missing in known_hosts for {len(missing_host_keys)} host(s):")
             for host in missing_host_keys:
                 print(f"      - {host['name']} ({host['ip']})")
             print(f"\n    To fix, run on bastion host:")
             print(f"      ssh-keyscan -H <host_ip> >> {known_hosts_path}")
             print(f"    Or for all hosts at once:")
-            host_ips = ' '.join([h['ip'] for h in missing_host_keys])
+            host_ips = ' '.join([str(h['ip']) for h in missing_host_keys])
             print(f"      ssh-keyscan -H {host_ips} >> {known_hosts_path}")
         
+        if mismatched_host_keys:
+            print(f"\n  ✗ Host keys in known_hosts do not match {len(mismatched_host_keys)} host(s):")
+            for host in mismatched_host_keys:
+                print(f"      - {host['name']} ({host['ip']})")
+            print(f"\n    If the host was reinstalled, replace the stale entry on bastion host:")
+            print(f"      ssh-keygen -R <host_ip> -f {known_hosts_path}")
+            print(f"      ssh-keyscan -H <host_ip> >> {known_hosts_path}")
+        
         sys.exit(1)
 
 